@@ -6,7 +6,10 @@ Since:
     07/02/2024
 """
 
+import os
+import re
 import sys
+from operator import attrgetter
 
 BLOCK_START = "{"
 """ The BibTeX block start character.
@@ -20,6 +23,39 @@ LIST_SEP = ","
 """ The BibTeX list separator character.
 """
 
+READ_CHUNK_SIZE = 1 << 20
+""" The number of characters read from a file at a time when streaming entries from it.
+"""
+
+
+_TOKEN_RE = re.compile(f"[^{re.escape(LIST_SEP)}{re.escape(BLOCK_END)}\\s]*")
+""" The pattern matching a standalone value outside a block (e.g. a year or a month macro).
+"""
+
+_QUOTED_RE = re.compile(r'"([^"]*)"')
+""" The pattern matching a quoted literal, capturing the text between the quotes.
+"""
+
+_WS_RE = re.compile(r"\s*")
+""" The pattern matching a (possibly empty) run of whitespace.
+"""
+
+_FIELD_TAIL_RE = re.compile(f"\\s*{re.escape(LIST_SEP)}?\\s*")
+""" The pattern matching everything between the end of a field value and the start of the next key (whitespace around an optional list separator).
+"""
+
+_STRUCTURAL_RE = re.compile(r"[@{}]")
+""" The pattern matching structural characters at the document level (entry starts and block delimiters).
+"""
+
+_FIELD_SORT_KEY = attrgetter("key")
+""" The sort key for fields (their key).
+"""
+
+_ENTRY_SORT_KEY = attrgetter("name")
+""" The sort key for entries (their name).
+"""
+
 
 def skip_whitespace (source: str, start: int):
     """ Returns the index of the next non-whitespace character from a position in some source code.
@@ -30,10 +66,148 @@ def skip_whitespace (source: str, start: int):
     Returns:
         int: The position of the next non-whitespace character after the start index in the string.
     """
-    i = start
-    while i < len(source) and source[i].isspace():
-        i += 1
-    return i
+    return _WS_RE.match(source, start).end()
+
+
+def _tokenize (source: str):
+    """ Builds an index of the structural characters in some BibTeX source code.
+
+    Args:
+        source (str): The BibTeX source code.
+    Returns:
+        list: A list of (position, character) tuples, one for each '@' or block delimiter in the source, in order.
+    """
+    return [(match.start(), match.group()) for match in _STRUCTURAL_RE.finditer(source)]
+
+
+class _EntrySplitter:
+    """ Splits BibTeX source code into its top-level entries without parsing them, as the source is fed in piece by piece.
+    
+    Each piece is scanned once, with block depth and the position of any unfinished entry carried over to the next piece.
+    """
+    
+    __slots__ = ("pieces", "end", "last", "at", "level", "type", "body")
+    
+    def __init__ (self):
+        """ Initializes a new instance of an entry splitter.
+        """
+        self.pieces = [] # (position, source) pairs for pieces still needed to slice out entries.
+        self.end = 0 # Position just past the source fed in so far.
+        self.last = 0 # End of the last entry read.
+        self.at = -1 # Position of the '@' starting the current entry, if any.
+        self.level = 0
+        self.type = None
+        self.body = 0
+        
+    def _slice (self, start: int, stop: int):
+        """ Returns the source between two positions, joining pieces only when it spans more than one.
+        
+        Args:
+            start (int): The start position.
+            stop (int): The end position (exclusive).
+        Returns:
+            str: The source between the two positions.
+        """
+        parts = []
+        for piece_start, piece in self.pieces:
+            if piece_start >= stop:
+                break
+            if piece_start + len(piece) > start:
+                parts.append(piece[max(start - piece_start, 0):stop - piece_start])
+        return parts[0] if len(parts) == 1 else "".join(parts)
+        
+    def feed (self, source: str):
+        """ Feeds in the next piece of source code.
+        
+        Args:
+            source (str): The next piece of BibTeX source code.
+        Returns:
+            list: A list of (type, source) tuples, one for each entry completed by this piece, in order.
+        """
+        splits = []
+        offset = self.end
+        self.pieces.append((offset, source))
+        self.end += len(source)
+        
+        # Walk the structural index rather than the source itself, tracking block depth as we go.
+        last, at, level, type, body = self.last, self.at, self.level, self.type, self.body
+        for pos, char in _tokenize(source):
+            pos += offset
+            if level == 0 and at < 0:
+                
+                # Every entry starts with an '@', with only whitespace since the last one.
+                gap = self._slice(last, pos).lstrip()
+                if gap or char != "@":
+                    raise SyntaxError(f"Expected an '@' to start an item but got '{gap[:1] or char}' instead.")
+                at = pos
+            elif level == 0 and char != BLOCK_START:
+                
+                # After the '@', the entry type must run straight up to an opening brace.
+                raise SyntaxError(f"Expected a '{BLOCK_START}' after the entry type '{self._slice(at + 1, pos).strip()}' but got '{char}' instead.")
+            elif char == BLOCK_START:
+                
+                # Type runs from the '@' up to the opening brace of the entry.
+                level += 1
+                if level == 1:
+                    type = self._slice(at + 1, pos)
+                    body = pos + 1
+            elif char == BLOCK_END:
+                level -= 1
+                if level == 0:
+                    
+                    # Strip whitespace from type and add entry.
+                    splits.append((type.strip(), self._slice(body, pos)))
+                    at = -1
+                    last = pos + 1
+        self.last, self.at, self.level, self.type, self.body = last, at, level, type, body
+        
+        # Let go of pieces wholly before the end of the last entry, nothing will be sliced from them again.
+        while len(self.pieces) > 1 and self.pieces[1][0] <= last:
+            del self.pieces[0]
+            
+        return splits
+        
+    def close (self):
+        """ Checks nothing is left dangling after the last entry, once all source code has been fed in.
+        """
+        if self.at >= 0 and self.level == 0:
+            raise SyntaxError(f"Unexpected end of input after the entry type '{self._slice(self.at + 1, self.end).strip()}', expected a '{BLOCK_START}' block open character.")
+        if self.at >= 0:
+            raise SyntaxError(f"Unexpected end of input while reading an item, expected a '{BLOCK_END}' block close character.")
+        rest = self._slice(self.last, self.end).lstrip()
+        if rest:
+            raise SyntaxError(f"Expected an '@' to start an item but got '{rest[0]}' instead.")
+
+
+def _split_entries (source: str):
+    """ Splits a BibTeX source file into its top-level entries, without parsing them.
+
+    Args:
+        source (str): The BibTeX source code.
+    Returns:
+        list: A list of (type, source) tuples, one for each entry in the source, in order.
+    """
+    splitter = _EntrySplitter()
+    splits = splitter.feed(source)
+    splitter.close()
+    return splits
+
+
+def _stream_entries (file):
+    """ Splits a BibTeX file into its top-level entries as it is read in, without parsing them.
+
+    Args:
+        file (TextIO): The file to read from.
+    Returns:
+        Iterator[tuple]: An iterator over (type, source) tuples, one for each entry in the file, in order.
+    """
+    splitter = _EntrySplitter()
+    while True:
+        chunk = file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield from splitter.feed(chunk) # Yield every entry completed by this chunk.
+    splitter.close()
 
 
 def read_next_block (
@@ -60,74 +234,96 @@ def read_next_block (
     if source[i] != start_delimiter:
         raise SyntaxError(f"Cannot read a block when input stream does not start with a '{start_delimiter}' block open character. Instead, found '{source[i]}'.")
     
-    buffer = "" # Build buffer of text.
-    i += 1 # Next character to get inside the block.
+    # Step inside the block and read the rest of it.
+    return _read_block_body(source, i + 1, include_delimiters, start_delimiter, end_delimiter)
+
+
+def _read_block_body (
+        source: str, 
+        start: int, 
+        include_delimiters: bool = False, 
+        start_delimiter: str = BLOCK_START, 
+        end_delimiter: str = BLOCK_END):
+    """ Reads the rest of a block in a BibTeX source file, once its start delimiter has been consumed.
+    
+    Args:
+        source (str): The BibTeX source code.
+        start (int): The position just inside the block in the source code.
+        include_delimiters (bool): Whether or not to include non-root-level delimiters.
+        start_delimiter (str): The block start delimiter token (defaults to "{").
+        end_delimiter (str): The block end delimiter token (defaults to "}").
+    Returns:
+        str: The source code of the BibTeX block.
+    """
+    parts = [] # Build list of text slices.
+    i = start
     level = 1 # We're at level 1.
+    next_start = -1 # Position of the next start delimiter, found lazily.
     while level > 0:
-        if source[i] in [start_delimiter, end_delimiter]:
 
-            # We have a delimiter, so change the level.
-            level += 1 if source[i] == start_delimiter else -1
+        # Jump straight to the next delimiter instead of walking character by character.
+        if next_start < i:
+            next_start = source.find(start_delimiter, i)
+            if next_start == -1:
+                next_start = len(source)
+        next_end = source.find(end_delimiter, i)
+        if next_end == -1:
+            raise SyntaxError(f"Unexpected end of input while reading a block, expected a '{end_delimiter}' block close character.")
+        j = min(next_start, next_end)
+
+        # Everything up to the delimiter goes into the buffer in one slice.
+        parts.append(source[i:j])
 
-            # Include non-root delimiters always.
-            if include_delimiters or level > 0:
-                buffer += source[i]
-        else:
-            buffer += source[i]
-        i += 1
+        # We have a delimiter, so change the level.
+        level += 1 if j == next_start else -1
+
+        # Include non-root delimiters always.
+        if include_delimiters or level > 0:
+            parts.append(source[j])
+        i = j + 1
 
     # Return tuple of the buffer contents and its ending index.
-    return (buffer, i)
+    return ("".join(parts), i)
 
 
-def read_next_value (
-        source: str,
-        start: int, 
-        include_delimiters: str = False, 
-        start_delimiter: str = BLOCK_START, 
-        end_delimiter: str = BLOCK_END):
+def read_next_value (source: str, start: int):
     """ Reads the next value in a BibTeX source file (block or quoted literal).
     
     Args:
         source (str): The BibTeX source code.
         start (int): The current position in the source code.
-        include_delimiters (bool): Whether or not to include non-root-level delimiters.
-        start_delimiter (str): The block start delimiter token (defaults to "{").
-        end_delimiter (str): The block end delimiter token (defaults to "}").
     Returns:
         str: The source code of the next BibTeX block.
     """
     # Skip forward past any whitespace.
     i = skip_whitespace(source, start)
     
-    buffer = "" # Build buffer of text.
-    if source[i] == start_delimiter:
+    if source[i] == BLOCK_START:
         
-        # Simple, we have a block.
-        buffer, i = read_next_block(source, start, include_delimiters, start_delimiter, end_delimiter)
-    elif source[i] == "\"":
+        # Simple, we have a block. We're already on its start delimiter, so read straight from inside it.
+        return _read_block_body(source, i + 1)
+    
+    if source[i] == "\"":
         
-        # We have a quoted literal. Skip first quote, read up to next quote and skip final quote.
-        i += 1
-        while source[i] != "\"": 
-            buffer += source[i]
-            i += 1
-        i += 1
-    else:
+        # We have a quoted literal. Match up to and including the closing quote.
+        match = _QUOTED_RE.match(source, i)
+        if match is None:
+            raise SyntaxError("Unexpected end of input while reading a quoted literal, expected a closing '\"'.")
+        return (match.group(1), match.end())
         
-        # Standalone value outside a block.
-        while source[i] not in [LIST_SEP, end_delimiter] and not source[i].isspace(): # Stop on list separator, block end or space.
-            buffer += source[i]
-            i += 1
-            
+    # Standalone value outside a block, stop on list separator, block end or space.
+    end = _TOKEN_RE.match(source, i).end()
+    
     # Return tuple of the buffer contents and its ending index.
-    return (buffer, i)
+    return (source[i:end], end)
 
 
 class BibtexField:
     """ Represents a BibTeX field.
     """
     
+    __slots__ = ("key", "value")
+    
     def __init__ (self, key: str, value: str):
         """ Initializes a new instance of a BibTeX field.
         
@@ -144,6 +340,7 @@ class BibtexField:
         Returns:
             str: The source code representing this BibTeX field.
         """
+        # BibtexEntry.to_bibtex inlines this same format rather than calling this per field, so change both together.
         return f"{self.key}={{{self.value}}}"
 
 
@@ -151,6 +348,8 @@ class BibtexEntry:
     """ Represents a BibTeX entry.
     """
     
+    __slots__ = ("type", "name", "fields")
+    
     def __init__ (self, type: str, source: str):
         """ Initializes a new instance of a BibTeX entry.
         
@@ -165,55 +364,46 @@ class BibtexEntry:
         # Capture type.
         self.type = type
         
-        # Initialize source code pointer.
-        i = 0
-        
-        # Read in name.
-        name = ""
-        while source[i] != LIST_SEP:
-            name += source[i]
-            i += 1
+        # Read in name, up to the first list separator.
+        i = source.find(LIST_SEP)
+        if i == -1:
+            raise SyntaxError(f"Expected a '{LIST_SEP}' after the name of an entry of type '{type}'.")
             
-        self.name = name.strip() # Strip whitespace from name.
+        self.name = source[:i].strip() # Strip whitespace from name.
         
         i += 1 # Skip comma.
         
         i = skip_whitespace(source, i) # Skip whitespace.
         
-        # Process source.
-        while i < len(source):
+        # Process source, taking its length and the field list's append method once up front.
+        n = len(source)
+        append = self.fields.append
+        while i < n:
             
-            # Read in key.
-            key = ""
-            while source[i] != "=":
-                key += source[i]
-                i += 1
+            # Read in key, up to the next equals sign.
+            j = source.find("=", i)
+            if j == -1:
+                raise SyntaxError(f"Expected an '=' after a field key in entry '{self.name}'.")
                 
-             # Strip whitespace from key.
-            key = key.strip()
+            # Strip whitespace from key.
+            key = source[i:j].strip()
             
             # Skip equals sign.
-            i += 1 
-            
-            # Skip any pre-value whitespace.
-            i = skip_whitespace(source, i)
+            i = j + 1
             
-            # Read next value.
+            # Read next value (this skips any pre-value whitespace).
             value, i = read_next_value(source, i)
             
-            # Skip whatever delimiter we hit (usually a comma).
-            i += 1
-            
             # Strip whitespace from value and add field.
-            self.fields.append(BibtexField(key, value.strip()))
+            append(BibtexField(key, value.strip()))
             
-            # Skip whitespace, we're primed to loop again.
-            i = skip_whitespace(source, i)
+            # Skip the list separator and whitespace either side of it in one go, we're primed to loop again.
+            i = _FIELD_TAIL_RE.match(source, i).end()
             
     def sort_fields (self):
         """ Sorts all fields in the entry alphabetically.
         """
-        self.fields.sort(key=lambda field: field.key)
+        self.fields.sort(key=_FIELD_SORT_KEY)
         
     def to_bibtex (self):
         """ Converts this BibTeX entry to its representation in source code.
@@ -221,62 +411,44 @@ class BibtexEntry:
         Returns:
             str: The source code representing this BibTeX entry.
         """
-        # Open entry.
-        buffer = f"@{self.type.lower()}{{{self.name},\n  "
-        
-        # Add fields.
-        buffer += ",\n  ".join([f.to_bibtex() for f in self.fields])
-        
-        # Close entry.
-        buffer += "\n}"
-        
-        return buffer
+        # Open entry, add fields (formatted inline as in BibtexField.to_bibtex) and close entry in one go.
+        return (f"@{self.type.lower()}{{{self.name},\n  "
+            + ",\n  ".join([f"{f.key}={{{f.value}}}" for f in self.fields])
+            + "\n}")
 
 
 class BibtexDocument:
     """ Represents a BibTeX document.
     """
     
+    __slots__ = ("entries",)
+    
     def __init__(self, source):
         """ Initializes a new instance of a BibTeX document.
         
         Args:
             source (str): The source code comprising the document.
         """
-        self.entries = []
+        self.entries = [BibtexEntry(type, body) for type, body in _split_entries(source)]
         
-        # Skip initial whitespace.
-        i = skip_whitespace(source, 0)
+    @classmethod
+    def from_file (cls, path: str):
+        """ Reads in a BibTeX document from a file, splitting out entries as the file is read rather than all at once.
         
-        # Loop over source.
-        while i < len(source):
-            
-            # Every entry starts with an '@'.
-            if source[i] != "@":
-                raise SyntaxError(f"Expected an '@' to start an item but got '{source[i]}' instead.")
-            
-            # Starting symbol found! Move on.
-            i += 1
-            
-            # Read in type.
-            type = ""
-            while source[i] != BLOCK_START:
-                type += source[i]
-                i += 1
-                
-            # Read block.
-            value, i = read_next_value(source, i)
-            
-            # Strip whitespace from type and add entry.
-            self.entries.append(BibtexEntry(type.strip(), value))
-            
-            # Skip whitespace, we're primed to loop again.
-            i = skip_whitespace(source, i)
+        Args:
+            path (str): The path of the file to read.
+        Returns:
+            BibtexDocument: The BibTeX document.
+        """
+        document = cls.__new__(cls)
+        with open(path, encoding="utf-8") as file:
+            document.entries = [BibtexEntry(type, body) for type, body in _stream_entries(file)]
+        return document
             
     def sort_entries (self):
         """ Sorts all entries in the document alphabetically.
         """
-        self.entries.sort(key=lambda entry: entry.name)
+        self.entries.sort(key=_ENTRY_SORT_KEY)
         
     def sort_fields (self):
         """ Sorts all fields within entries in the document alphabetically.
@@ -291,26 +463,38 @@ class BibtexDocument:
             str: The source code representing this BibTeX document.
         """
         return "\n\n".join([entry.to_bibtex() for entry in self.entries])
+        
+    def write_to (self, file, newline: str = "\n"):
+        """ Writes this BibTeX document's source code to a binary file an entry at a time, rather than all at once.
+        
+        Args:
+            file (BinaryIO): The file to write to.
+            newline (str): The line ending to write (defaults to "\\n", pass os.linesep to match a text-mode file).
+        """
+        separator = ""
+        for entry in self.entries:
+            source = separator + entry.to_bibtex()
+            if newline != "\n":
+                source = source.replace("\n", newline)
+            file.write(source.encode("utf-8"))
+            separator = "\n\n"
 
 
 if __name__ == "__main__":
     
-    # Read in file content.
-    file_content = None
-    with open("main.bib" if len(sys.argv) < 2 else sys.argv[1]) as file:
-        file_content = file.read()
-
-    # Parse document.
-    document = BibtexDocument(file_content)
+    # Read in and parse document.
+    document = BibtexDocument.from_file("main.bib" if len(sys.argv) < 2 else sys.argv[1])
     
     if '-f' in sys.argv:
         document.sort_fields() # Sort fields if '-f' flag passed.
     if '-S' not in sys.argv:
         document.sort_entries() # Skip sorting entries if '-S' flag passed.
         
-    # Print document formatted or save if filename specified.
+    # Print document formatted or save if filename specified, with platform line endings as text mode would write.
     if len(sys.argv) < 3:
-        print(document.to_bibtex())
+        document.write_to(sys.stdout.buffer, os.linesep)
+        sys.stdout.buffer.write(os.linesep.encode("utf-8"))
+        sys.stdout.buffer.flush()
     else:
-        with open(sys.argv[2], 'w') as file:
-            file.write(document.to_bibtex())
+        with open(sys.argv[2], 'wb', buffering=1 << 20) as file:
+            document.write_to(file, os.linesep)